@@ -0,0 +1,25 @@
+# cython: boundscheck=False, wraparound=False, language_level=3
+"""Cython version of the sequential Bellman update in train_q_agent.
+
+Compiled on demand via pyximport when Cython is installed; train_q_agent
+falls back to the numba/NumPy paths otherwise.
+"""
+
+
+from libc.stdint cimport int64_t
+
+
+def train(const int64_t[:] codes, const int64_t[:] actions, const float[:] rewards,
+          float[:, :] flat_q, double alpha, double gamma):
+    cdef Py_ssize_t i, n = codes.shape[0]
+    cdef int64_t code, next_code, action_taken
+    cdef float old_q, next_stay, next_switch, max_next_q
+    for i in range(n - 1):
+        code = codes[i]
+        next_code = codes[i + 1]
+        action_taken = actions[i]
+        old_q = flat_q[code, action_taken]
+        next_stay = flat_q[next_code, 0]
+        next_switch = flat_q[next_code, 1]
+        max_next_q = next_stay if next_stay >= next_switch else next_switch
+        flat_q[code, action_taken] = <float>(old_q + alpha * (rewards[i] + gamma * max_next_q - old_q))
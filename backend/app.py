@@ -1,58 +1,106 @@
 import os
-import json
 import logging
 import time
-import threading
+import asyncio
+import atexit
 import csv
+import sqlite3
+from collections import defaultdict
+from contextlib import suppress
 from typing import Dict, Optional
 
 import numpy as np
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+import orjson
+from fastapi import BackgroundTasks, FastAPI, Response, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
 
+try:
+    from numba import njit
+except ImportError:  # numba is optional; the pure-Python decision path still works
+    njit = None
+
 # --- Paths ---
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 CONFIG_FILE = os.path.join(BASE_DIR, "config.json")
-STATE_FILE = os.path.join(BASE_DIR, "traffic_state.json")
+STATE_FILE = os.path.join(BASE_DIR, "traffic_state.json")  # legacy; migrated into the DB
+STATE_DB_FILE = os.path.join(BASE_DIR, "traffic_state.db")
 TRAFFIC_LOG_FILE = os.path.join(BASE_DIR, "traffic_log.csv")
 Q_TABLE_FILE = os.path.join(BASE_DIR, "q_table.json")
+Q_TABLE_NPY_FILE = os.path.join(BASE_DIR, "q_table.npy")
 
 # --- Logging ---
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 # --- Q-learning Setup ---
-Q_table: Dict = {}
 ALPHA = 0.1
 GAMMA = 0.9
 EPSILON = 0.1
-WAITING_BINS = [0, 5, 15, 30, 50, np.inf]
+WAITING_BINS = [0, 5, 15, 30, 50]  # upper edge is open-ended
+N_BINS = len(WAITING_BINS)
 ACTIONS = [0, 1]  # 0 = stay, 1 = switch
 
-def get_state_bin(waiting_cars):
-    return int(np.digitize(waiting_cars, WAITING_BINS) - 1)
-
-def get_discrete_state(vertical_waiting, horizontal_waiting, current_green_direction):
-    v_bin = get_state_bin(vertical_waiting)
-    h_bin = get_state_bin(horizontal_waiting)
-    return (v_bin, h_bin, current_green_direction)
-
-def initialize_q_state(state):
-    if state not in Q_table:
-        Q_table[state] = {action: 0.0 for action in ACTIONS}
-
-# Load Q-table if exists
-if os.path.exists(Q_TABLE_FILE):
+# Dense Q-table indexed [v_bin, h_bin, green_direction, action]. The state
+# space is tiny (5 x 5 x 2), so a contiguous array replaces the old
+# dict-of-dicts: plain integer indexing, no tuple hashing, and every state
+# starts initialized to zero.
+Q_table = np.zeros((N_BINS, N_BINS, 2, len(ACTIONS)), dtype=np.float32)
+
+def _decide(vertical_waiting, horizontal_waiting, green_direction, q_table, min_green, time_since_last_change):
+    """Numeric core of the per-request decision: returns (action, reward).
+
+    Binning is inlined (same edges as WAITING_BINS) so the whole function is
+    plain arithmetic and array indexing, compilable by numba when available.
+    """
+    if time_since_last_change < min_green:
+        return 0, 0
+    v = 0 if vertical_waiting < 5 else 1 if vertical_waiting < 15 else 2 if vertical_waiting < 30 else 3 if vertical_waiting < 50 else 4
+    h = 0 if horizontal_waiting < 5 else 1 if horizontal_waiting < 15 else 2 if horizontal_waiting < 30 else 3 if horizontal_waiting < 50 else 4
+    if q_table[v, h, green_direction, 1] > q_table[v, h, green_direction, 0]:
+        return 1, -(vertical_waiting + horizontal_waiting)
+    return 0, 0
+
+if njit is not None:
+    _decide = njit(cache=True)(_decide)
+
+def parse_q_key(key):
+    """Parse a serialized state key like "0,1,0" (or legacy "(0, 1, 0)") to a tuple."""
+    parts = key.strip("() ").split(",")
+    if len(parts) != 3:
+        raise ValueError(f"Malformed Q-table key: {key!r}")
+    return tuple(int(part) for part in parts)
+
+def parse_q_values(values):
+    """Normalize stored action values (list, or legacy {"0": ..., "1": ...} dict)."""
+    if isinstance(values, dict):
+        return [float(values.get("0", 0.0)), float(values.get("1", 0.0))]
+    return [float(values[0]), float(values[1])]
+
+# Load Q-table if exists: prefer the binary .npy form, fall back to legacy JSON
+if os.path.exists(Q_TABLE_NPY_FILE):
+    try:
+        loaded = np.load(Q_TABLE_NPY_FILE)
+        if loaded.shape == Q_table.shape:
+            Q_table = loaded.astype(np.float32, copy=False)
+            logging.info(f"Loaded Q-table from {Q_TABLE_NPY_FILE}")
+        else:
+            logging.error(f"Unexpected Q-table shape {loaded.shape} in {Q_TABLE_NPY_FILE}; starting with empty Q-table.")
+    except (IOError, ValueError) as e:
+        logging.error(f"Error loading Q-table from {Q_TABLE_NPY_FILE}: {e}. Starting with empty Q-table.")
+elif os.path.exists(Q_TABLE_FILE):
     try:
-        with open(Q_TABLE_FILE, "r") as f:
-            loaded_q_table = json.load(f)
-            Q_table = {eval(k): v for k, v in loaded_q_table.items()}
+        with open(Q_TABLE_FILE, "rb") as f:
+            loaded_q_table = orjson.loads(f.read())
+        for k, v in loaded_q_table.items():
+            Q_table[parse_q_key(k)] = parse_q_values(v)
         logging.info(f"Loaded Q-table from {Q_TABLE_FILE}")
-    except (json.JSONDecodeError, SyntaxError) as e:
+    except (orjson.JSONDecodeError, ValueError, IndexError) as e:
         logging.error(f"Error loading Q-table from {Q_TABLE_FILE}: {e}. Starting with empty Q-table.")
 
 # --- FastAPI ---
-app = FastAPI()
+# orjson-backed responses replace the stdlib encoder for every endpoint
+app = FastAPI(default_response_class=ORJSONResponse)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -79,12 +127,12 @@ class SensorInput(BaseModel):
 # --- Config ---
 def load_config():
     try:
-        with open(CONFIG_FILE, "r") as f:
-            return json.load(f)
+        with open(CONFIG_FILE, "rb") as f:
+            return orjson.loads(f.read())
     except FileNotFoundError:
         logging.warning("config.json not found, using default values.")
         return {"MIN_GREEN_TIME": 15, "YELLOW_TIME": 3}
-    except json.JSONDecodeError:
+    except orjson.JSONDecodeError:
         logging.error("Error decoding config.json, using default values.")
         return {"MIN_GREEN_TIME": 15, "YELLOW_TIME": 3}
 
@@ -95,12 +143,32 @@ YELLOW_TIME = config.get("YELLOW_TIME", 3)
 ALL_RED_TIME = config.get("ALL_RED_TIME", 2)
 
 # --- Persistent State ---
+# State lives in a small SQLite database in WAL mode: per-intersection upserts
+# instead of rewriting one JSON file per mutation, durable appends, and
+# concurrent readers alongside the writer.
+def _open_state_db():
+    conn = sqlite3.connect(STATE_DB_FILE, isolation_level=None, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("CREATE TABLE IF NOT EXISTS intersections (id TEXT PRIMARY KEY, data TEXT NOT NULL)")
+    return conn
+
+_state_db = _open_state_db()
+
 def load_state():
+    try:
+        rows = _state_db.execute("SELECT id, data FROM intersections").fetchall()
+    except sqlite3.Error as e:
+        logging.error(f"Error reading {STATE_DB_FILE}: {e}. Starting with a fresh state.")
+        rows = []
+    if rows:
+        return {row_id: orjson.loads(data) for row_id, data in rows}
+    # One-time migration from the legacy JSON state file
     if os.path.exists(STATE_FILE):
         try:
-            with open(STATE_FILE, "r") as f:
-                return json.load(f)
-        except json.JSONDecodeError:
+            with open(STATE_FILE, "rb") as f:
+                return orjson.loads(f.read())
+        except orjson.JSONDecodeError:
             logging.error(f"Error reading {STATE_FILE}. Starting with a fresh state.")
             return {}
     return {
@@ -112,15 +180,65 @@ def load_state():
         }
     }
 
-def save_state(state):
+def _state_rows(state):
+    return [(name, orjson.dumps(s).decode()) for name, s in state.items()]
+
+def _write_state_rows(rows):
     try:
-        with open(STATE_FILE, "w") as f:
-            json.dump(state, f, indent=4)
-    except IOError as e:
-        logging.error(f"Could not save state to {STATE_FILE}: {e}")
+        _state_db.executemany(
+            "INSERT INTO intersections (id, data) VALUES (?, ?) "
+            "ON CONFLICT(id) DO UPDATE SET data = excluded.data",
+            rows,
+        )
+    except sqlite3.Error as e:
+        logging.error(f"Could not save state to {STATE_DB_FILE}: {e}")
+
+def save_state(state):
+    _write_state_rows(_state_rows(state))
 
 state = load_state()
 
+# Serializes decisions per intersection under concurrent POSTs while leaving
+# different intersections free to proceed in parallel
+_intersection_locks: Dict[str, asyncio.Lock] = defaultdict(asyncio.Lock)
+
+# --- Debounced state persistence ---
+# Mutations only flag the state as dirty; a background task coalesces bursts
+# of updates and rewrites the file at most once per debounce interval.
+STATE_FLUSH_DEBOUNCE = 0.5
+_state_dirty = asyncio.Event()
+_main_loop = None
+
+def mark_state_dirty():
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        # Called from a worker thread (or before startup): hand off to the
+        # event loop if we have one, otherwise fall back to a direct write.
+        if _main_loop is not None:
+            _main_loop.call_soon_threadsafe(_state_dirty.set)
+        else:
+            save_state(state)
+        return
+    _state_dirty.set()
+
+async def _state_persister():
+    loop = asyncio.get_running_loop()
+    while True:
+        await _state_dirty.wait()
+        await asyncio.sleep(STATE_FLUSH_DEBOUNCE)
+        _state_dirty.clear()
+        try:
+            # Serialize on the loop thread so the live dict is never iterated
+            # while a request handler mutates it; only the DB write leaves
+            # the loop
+            rows = _state_rows(state)
+            await loop.run_in_executor(None, _write_state_rows, rows)
+        except Exception:
+            logging.exception("State flush failed; retrying on next change")
+
+atexit.register(lambda: save_state(state))
+
 # --- New: Actuated controller with WS broadcast ---
 try:
     from controller import ActuatedController, ControllerConfig
@@ -129,6 +247,12 @@ except Exception:
 
 controller = None
 clients = set()
+# Resend an unchanged snapshot at most this often so clients can still
+# detect a live connection
+WS_HEARTBEAT_INTERVAL = 5.0
+# Snapshot fields that change every tick regardless of traffic; excluded when
+# deciding whether a broadcast is worth sending
+_VOLATILE_SNAP_FIELDS = ("t", "time_in_stage")
 
 async def controller_loop():
     global controller
@@ -148,65 +272,118 @@ async def controller_loop():
         await controller.update_sensor(state.get("main", {}).get("waiting_cars", {}))
     except Exception:
         pass
+    last_sent_key = b""
+    last_sent_at = 0.0
     while True:
         try:
             await controller.tick()
             snap = controller.snapshot()
-            # broadcast to WS clients
+            # broadcast to WS clients concurrently; one slow client no longer
+            # stalls the others for the whole tick
             if clients:
-                dead = []
-                for ws in list(clients):
-                    try:
-                        await ws.send_json({"type": "state", "data": snap})
-                    except Exception:
-                        dead.append(ws)
-                for d in dead:
-                    clients.discard(d)
+                # Skip the send entirely when nothing meaningful changed since
+                # the last broadcast (idle intersections otherwise push 10
+                # identical frames per second per client)
+                snap_key = orjson.dumps({k: v for k, v in snap.items() if k not in _VOLATILE_SNAP_FIELDS})
+                now = time.time()
+                if snap_key != last_sent_key or now - last_sent_at >= WS_HEARTBEAT_INTERVAL:
+                    last_sent_key = snap_key
+                    last_sent_at = now
+                    # Serialize once for all clients; frontends JSON.parse text frames
+                    message = orjson.dumps({"type": "state", "data": snap}).decode()
+                    receivers = list(clients)
+                    results = await asyncio.gather(
+                        *(ws.send_text(message) for ws in receivers),
+                        return_exceptions=True,
+                    )
+                    for ws, result in zip(receivers, results):
+                        if isinstance(result, Exception):
+                            clients.discard(ws)
         except Exception:
             pass
         await asyncio.sleep(0.1)
 
 # --- Logging traffic data for training ---
-def log_traffic_data(intersection_id, vertical_waiting, horizontal_waiting, current_vertical_light, current_horizontal_light, action_taken, reward):
-    file_exists = os.path.isfile(TRAFFIC_LOG_FILE)
-    with open(TRAFFIC_LOG_FILE, 'a', newline='') as csvfile:
-        fieldnames = ['timestamp', 'intersection_id', 'vertical_waiting', 'horizontal_waiting', 'current_vertical_light', 'current_horizontal_light', 'action_taken', 'reward']
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-        if not file_exists:
-            writer.writeheader()
-        writer.writerow({
-            'timestamp': time.time(),
-            'intersection_id': intersection_id,
-            'vertical_waiting': vertical_waiting,
-            'horizontal_waiting': horizontal_waiting,
-            'current_vertical_light': current_vertical_light,
-            'current_horizontal_light': current_horizontal_light,
-            'action_taken': action_taken,
-            'reward': reward,
-        })
+# Rows are buffered in memory and appended to the CSV by a background task so
+# the per-request path never blocks on file I/O.
+LOG_FLUSH_INTERVAL = 1.0
+_LOG_FIELDS = ('timestamp', 'intersection_id', 'vertical_waiting', 'horizontal_waiting', 'current_vertical_light', 'current_horizontal_light', 'action_taken', 'reward')
+_log_buffer = []
+_log_lock = asyncio.Lock()
+# Whether the CSV already has its header row; checked once at import instead
+# of stat()ing the file on every flush
+_log_header_written = os.path.isfile(TRAFFIC_LOG_FILE)
+
+def log_traffic_data(intersection_id, vertical_waiting, horizontal_waiting, current_vertical_light, current_horizontal_light, action_taken, reward, ts=None):
+    # Tuple in _LOG_FIELDS order; csv.writer.writerows skips the per-row
+    # dict-to-list translation DictWriter would do
+    _log_buffer.append((
+        ts if ts is not None else time.time(),
+        intersection_id,
+        vertical_waiting,
+        horizontal_waiting,
+        current_vertical_light,
+        current_horizontal_light,
+        action_taken,
+        reward,
+    ))
+
+def _write_log_rows(rows):
+    global _log_header_written
+    with open(TRAFFIC_LOG_FILE, 'a', newline='', buffering=1 << 20) as csvfile:
+        writer = csv.writer(csvfile)
+        if not _log_header_written:
+            writer.writerow(_LOG_FIELDS)
+            _log_header_written = True
+        writer.writerows(rows)
+
+async def _flush_logs():
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(LOG_FLUSH_INTERVAL)
+        async with _log_lock:
+            rows = _log_buffer[:]
+            del _log_buffer[:len(rows)]
+        if rows:
+            try:
+                await loop.run_in_executor(None, _write_log_rows, rows)
+            except OSError as e:
+                # Disk full / file locked: put the batch back so it is
+                # retried next interval instead of killing the flusher
+                logging.error(f"Could not write traffic log: {e}")
+                async with _log_lock:
+                    _log_buffer[:0] = rows
 
 # --- API ---
 @app.post("/traffic")
-async def update_traffic(data: TrafficInput, intersection: str = "main"):
-    if intersection not in state:
-        state[intersection] = {
-            "lights": {"vertical": "green", "horizontal": "red"},
-            "waiting_cars": {"north": 0, "south": 0, "east": 0, "west": 0},
-            "last_change_time": time.time(),
-            "is_changing": False,
-        }
-    state[intersection]["waiting_cars"] = data.dict()
+async def update_traffic(data: TrafficInput, background_tasks: BackgroundTasks, intersection: str = "main"):
+    now = time.time()  # single timestamp for the whole request
+    async with _intersection_locks[intersection]:
+        if intersection not in state:
+            state[intersection] = {
+                "lights": {"vertical": "green", "horizontal": "red"},
+                "waiting_cars": {"north": 0, "south": 0, "east": 0, "west": 0},
+                "last_change_time": now,
+                "is_changing": False,
+            }
+        payload = data.dict()  # serialize once; reused for state and the controller
+        # Polling frontends often repost identical counts; only touch (and later
+        # persist) the state when something actually changed
+        counts_changed = state[intersection]["waiting_cars"] != payload
+        if counts_changed:
+            state[intersection]["waiting_cars"] = payload
     # Legacy logic retained; new controller will consider these queues too
     if not controller:
-        # Only use legacy logic if new controller is not active
-        run_ai_logic(intersection)
+        # Only use legacy logic if new controller is not active; run it after
+        # the response is sent so it stays off the request's critical path
+        background_tasks.add_task(run_ai_logic, intersection, now)
     # Also feed the actuated controller immediately and set phase preference by bigger queue
     try:
         if controller:
-            ns_total = int(data.north) + int(data.south)
-            ew_total = int(data.east) + int(data.west)
+            ns_total = data.north + data.south
+            ew_total = data.east + data.west
             preferred = "NS" if ns_total >= ew_total else "EW"
-            await controller.update_sensor(data.dict())
+            await controller.update_sensor(payload)
             # Request preferred phase; controller will honor it when safe (after clearance)
             try:
                 await controller.request_phase_preference(preferred)  # type: ignore[attr-defined]
@@ -214,7 +391,8 @@ async def update_traffic(data: TrafficInput, intersection: str = "main"):
                 pass
     except Exception:
         pass
-    save_state(state)
+    if counts_changed:
+        mark_state_dirty()
     return {"message": f"Traffic data updated for {intersection}"}
 
 @app.post("/sensor")
@@ -225,10 +403,15 @@ async def sensor(data: SensorInput):
     return {"ok": True}
 
 @app.get("/state")
-def get_state_api(intersection: str = "main"):
+async def get_state_api(intersection: str = "main"):
+    # Runs on the event loop (no blocking work here) so snapshot()'s reused
+    # payload is never mutated from a threadpool thread mid-broadcast
     # Prefer the new controller snapshot if available
     if controller:
-        return controller.snapshot()
+        snap = controller.snapshot()
+        # Copy the reused payload (and its mutable queues dict) so the
+        # broadcast loop can't overwrite it before the response renders
+        return {**snap, "queues": dict(snap["queues"])}
     if intersection not in state:
         return {"error": "Intersection not found"}
     s = state[intersection]
@@ -243,33 +426,38 @@ def get_state_api(intersection: str = "main"):
     }
 
 # --- Simple health and help endpoints ---
+# Both responses are static; encode them once at import and return raw bytes,
+# bypassing the per-request jsonable_encoder + json.dumps machinery.
+_HEALTH_JSON = orjson.dumps({"status": "ok"})
+_HELP_JSON = orjson.dumps({
+    "title": "AI Traffic Light Control System API",
+    "endpoints": {
+        "POST /traffic": {
+            "query": "?intersection=main",
+            "body": {"north": "int", "south": "int", "east": "int", "west": "int"},
+            "desc": "Send current vehicle counts; triggers decision logic.",
+        },
+        "GET /state": {
+            "query": "?intersection=main",
+            "desc": "Get current lights and seconds until next change.",
+        },
+        "POST /reset": {
+            "query": "?intersection=main",
+            "desc": "Reset an intersection to defaults.",
+        },
+        "GET /health": {"desc": "Service status."},
+    },
+})
+
 @app.get("/health")
 def health():
     """Health check endpoint."""
-    return {"status": "ok"}
+    return Response(content=_HEALTH_JSON, media_type="application/json")
 
 @app.get("/help")
 def api_help():
     """Describe how to use the API."""
-    return {
-        "title": "AI Traffic Light Control System API",
-        "endpoints": {
-            "POST /traffic": {
-                "query": "?intersection=main",
-                "body": {"north": "int", "south": "int", "east": "int", "west": "int"},
-                "desc": "Send current vehicle counts; triggers decision logic.",
-            },
-            "GET /state": {
-                "query": "?intersection=main",
-                "desc": "Get current lights and seconds until next change.",
-            },
-            "POST /reset": {
-                "query": "?intersection=main",
-                "desc": "Reset an intersection to defaults.",
-            },
-            "GET /health": {"desc": "Service status."},
-        },
-    }
+    return Response(content=_HELP_JSON, media_type="application/json")
 
 @app.post("/reset")
 def reset_intersection(intersection: str = "main"):
@@ -280,48 +468,47 @@ def reset_intersection(intersection: str = "main"):
         "last_change_time": time.time(),
         "is_changing": False,
     }
-    save_state(state)
+    mark_state_dirty()
     return {"message": f"Reset {intersection}"}
 
 # --- AI Logic ---
-def run_ai_logic(intersection: str = "main"):
-    s = state[intersection]
-    if s["is_changing"]:
-        return
-    now = time.time()
-    time_since_last_change = now - s["last_change_time"]
-    vertical_waiting = s["waiting_cars"]["north"] + s["waiting_cars"]["south"]
-    horizontal_waiting = s["waiting_cars"]["east"] + s["waiting_cars"]["west"]
-    current_vertical_light = s["lights"]["vertical"]
-    current_horizontal_light = s["lights"]["horizontal"]
-    current_green_direction = 0 if current_vertical_light == "green" else 1
-
-    current_state = get_discrete_state(vertical_waiting, horizontal_waiting, current_green_direction)
-    initialize_q_state(current_state)
-
-    # Choose best known action
-    action_to_take = int(np.argmax([Q_table[current_state][a] for a in ACTIONS]))
-    action_name = "stay"
-    reward = 0
-
-    if time_since_last_change < MIN_GREEN_TIME:
-        action_to_take = 0
+async def run_ai_logic(intersection: str = "main", now: Optional[float] = None):
+    async with _intersection_locks[intersection]:
+        s = state[intersection]
+        if s["is_changing"]:
+            return
+        if now is None:
+            now = time.time()
+        time_since_last_change = now - s["last_change_time"]
+        vertical_waiting = s["waiting_cars"]["north"] + s["waiting_cars"]["south"]
+        horizontal_waiting = s["waiting_cars"]["east"] + s["waiting_cars"]["west"]
+        current_vertical_light = s["lights"]["vertical"]
+        current_horizontal_light = s["lights"]["horizontal"]
+        current_green_direction = 0 if current_vertical_light == "green" else 1
+
+        action_to_take, reward = _decide(
+            vertical_waiting,
+            horizontal_waiting,
+            current_green_direction,
+            Q_table,
+            MIN_GREEN_TIME,
+            time_since_last_change,
+        )
         action_name = "stay"
-        reward = 0
-    elif action_to_take == 1:
-        start_light_change(intersection)
-        action_name = "switch"
-        reward = -(vertical_waiting + horizontal_waiting)
-
-    log_traffic_data(
-        intersection,
-        vertical_waiting,
-        horizontal_waiting,
-        current_vertical_light,
-        current_horizontal_light,
-        action_name,
-        reward,
-    )
+        if action_to_take == 1:
+            start_light_change(intersection)
+            action_name = "switch"
+
+        log_traffic_data(
+            intersection,
+            vertical_waiting,
+            horizontal_waiting,
+            current_vertical_light,
+            current_horizontal_light,
+            action_name,
+            reward,
+            ts=now,
+        )
 
 
 def start_light_change(intersection: str = "main"):
@@ -332,7 +519,7 @@ def start_light_change(intersection: str = "main"):
     if s["is_changing"]:
         return
 
-    def change_sequence():
+    async def change_sequence():
         s["is_changing"] = True
         if s["lights"]["vertical"] == "green":
             s["lights"]["vertical"] = "yellow"
@@ -340,13 +527,13 @@ def start_light_change(intersection: str = "main"):
         else:
             s["lights"]["horizontal"] = "yellow"
             changing_direction = "horizontal"
-        save_state(state)
-        time.sleep(YELLOW_TIME)
+        mark_state_dirty()
+        await asyncio.sleep(YELLOW_TIME)
         # All-red clearance: both directions red briefly to clear the intersection
         s["lights"]["vertical"] = "red"
         s["lights"]["horizontal"] = "red"
-        save_state(state)
-        time.sleep(ALL_RED_TIME)
+        mark_state_dirty()
+        await asyncio.sleep(ALL_RED_TIME)
         # Switch the right movement to green after clearance
         if changing_direction == "vertical":
             s["lights"]["horizontal"] = "green"
@@ -354,29 +541,32 @@ def start_light_change(intersection: str = "main"):
             s["lights"]["vertical"] = "green"
         s["last_change_time"] = time.time()
         s["is_changing"] = False
-        save_state(state)
+        mark_state_dirty()
 
-    threading.Thread(target=change_sequence, daemon=True).start()
-
-if __name__ == "__main__":
-    import uvicorn
-    import asyncio as _asyncio
-    # Kick off controller loop in background when running directly
-    try:
-        loop = _asyncio.get_event_loop()
-        loop.create_task(controller_loop())
-    except RuntimeError:
-        pass
-    uvicorn.run(app, host="0.0.0.0", port=8000)
-
-# ASGI startup event for controller when run under uvicorn/gunicorn
-import asyncio
-from contextlib import suppress
+    # A coroutine on the event loop replaces the per-change daemon thread
+    asyncio.create_task(change_sequence())
 
+# ASGI startup event for controller (also fires when run directly below)
 @app.on_event("startup")
 async def _start_controller():
+    global _main_loop
+    _main_loop = asyncio.get_running_loop()
+    if njit is not None:
+        # Warm the JIT so the first real request does not pay compile time
+        _decide(0, 0, 0, Q_table, MIN_GREEN_TIME, 0.0)
     with suppress(Exception):
         asyncio.create_task(controller_loop())
+    asyncio.create_task(_flush_logs())
+    asyncio.create_task(_state_persister())
+
+@app.on_event("shutdown")
+async def _drain_logs():
+    # Write out anything still buffered so rows are not lost on shutdown
+    async with _log_lock:
+        rows = _log_buffer[:]
+        del _log_buffer[:len(rows)]
+    if rows:
+        _write_log_rows(rows)
 
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
@@ -395,3 +585,8 @@ async def websocket_endpoint(websocket: WebSocket):
         pass
     finally:
         clients.discard(websocket)
+
+if __name__ == "__main__":
+    import uvicorn
+    # The startup event schedules the controller loop and background tasks
+    uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -1,14 +1,38 @@
 import asyncio
 import time
 from dataclasses import dataclass, field
-from typing import Dict, Literal, Optional
+from enum import IntEnum
+from typing import Dict, Optional, Union
 import logging
 
-PhaseGroup = Literal["NS", "EW"]
-Stage = Literal["GREEN", "YELLOW", "ALL_RED"]
+import numpy as np
 
 
-@dataclass
+class Phase(IntEnum):
+    NS = 0
+    EW = 1
+
+
+class Stage(IntEnum):
+    GREEN = 0
+    YELLOW = 1
+    ALL_RED = 2
+
+
+# Queue array layout: NS pair first, then EW, so phase sums are adjacent reads
+NORTH, SOUTH, EAST, WEST = 0, 1, 2, 3
+_DIR_IDX = {"north": NORTH, "south": SOUTH, "east": EAST, "west": WEST}
+
+# All six light combinations precomputed once, indexed [stage][phase]; yellow
+# shows on the outgoing direction only. Strings appear only at serialization.
+_LIGHTS = (
+    ({"vertical": "green", "horizontal": "red"}, {"vertical": "red", "horizontal": "green"}),
+    ({"vertical": "yellow", "horizontal": "red"}, {"vertical": "red", "horizontal": "yellow"}),
+    ({"vertical": "red", "horizontal": "red"}, {"vertical": "red", "horizontal": "red"}),
+)
+
+
+@dataclass(slots=True)
 class ControllerConfig:
     min_green: float = 10.0
     max_green: float = 120.0
@@ -17,191 +41,306 @@ class ControllerConfig:
     gap_seconds: float = 2.0
     queue_clear: bool = True
     priority_switch: bool = True
-    priority_factor: float = 2.0  # switch if opp >= factor * current
-    priority_min_queue: int = 6   # and opp at least this many
+    delta_q_lim: int = 6          # switch when opp_sum - cur_sum exceeds this
     all_red_hold_max: float = 5.0 # max extra wait in ALL_RED for clearance
+    all_red_min_preempt: float = 0.5  # min ALL_RED dwell before an empty intersection may fast-exit
 
 
-@dataclass
+@dataclass(slots=True)
 class ControllerState:
-    phase: PhaseGroup = "NS"
-    stage: Stage = "GREEN"
-    last_change: float = field(default_factory=time.time)
-    queues: Dict[str, int] = field(default_factory=lambda: {"north": 0, "south": 0, "east": 0, "west": 0})
-    last_arrival: Dict[PhaseGroup, float] = field(default_factory=lambda: {"NS": 0.0, "EW": 0.0})
+    phase: Phase = Phase.NS
+    stage: Stage = Stage.GREEN
+    # Internal timestamps use time.monotonic(): cheaper than wall time and
+    # immune to clock jumps; wall time only appears in snapshots.
+    last_change: float = field(default_factory=time.monotonic)
+    # Absolute deadlines recomputed on each stage entry, so tick compares
+    # against precomputed floats instead of re-deriving elapsed time.
+    min_deadline: float = 0.0   # earliest moment the stage may end
+    stage_deadline: float = 0.0  # hard upper bound for the stage
+    # Queue lengths indexed by NORTH/SOUTH/EAST/WEST; no string hashing on the
+    # hot path, exposed as a dict only in snapshot()
+    queues: np.ndarray = field(default_factory=lambda: np.zeros(4, dtype=np.int32))
+    # Running per-phase totals, delta-updated whenever queues change, so the
+    # tick decision and snapshot read plain ints instead of re-summing
+    ns_sum: int = 0
+    ew_sum: int = 0
+    last_arrival: Dict[Phase, float] = field(default_factory=lambda: {Phase.NS: 0.0, Phase.EW: 0.0})
     switches: int = 0
     throughput: int = 0
     waiting_total: int = 0
     occupancy: int = 0
-    pending_phase: Optional[PhaseGroup] = None
+    pending_phase: Optional[Phase] = None
 
 
 class ActuatedController:
     def __init__(self, cfg: ControllerConfig):
         self.cfg = cfg
+        # cfg values are constants after construction; copy them into flat
+        # instance attributes so the hot tick path and _enter_stage do one
+        # attribute lookup instead of chasing self.cfg.<field> every call
+        self._min_green = cfg.min_green
+        self._max_green = cfg.max_green
+        self._yellow = cfg.yellow
+        self._all_red = cfg.all_red
+        self._gap_seconds = cfg.gap_seconds
+        self._queue_clear = cfg.queue_clear
+        self._priority_switch = cfg.priority_switch
+        self._delta_q_lim = cfg.delta_q_lim
+        self._all_red_hold_max = cfg.all_red_hold_max
+        self._all_red_min_preempt = cfg.all_red_min_preempt
         self.state = ControllerState()
-        now = time.time()
-        self.state.last_arrival = {"NS": now, "EW": now}
+        now = time.monotonic()
+        self.state.last_arrival = {Phase.NS: now, Phase.EW: now}
+        self._enter_stage(Stage.GREEN, now)
         self._lock = asyncio.Lock()
+        self._sensor_q: asyncio.Queue = asyncio.Queue()
         self._log = logging.getLogger("controller")
+        # Reusable snapshot payload: snapshot() overwrites values in place
+        # instead of allocating a fresh nested dict per call. The config echo
+        # never changes after construction, so it is filled in once here.
+        self._snap: Dict = {
+            "phase": self.state.phase.name,
+            "stage": self.state.stage.name,
+            "time_in_stage": 0.0,
+            "time_to_next_change": 0,
+            "lights": self._current_lights(),
+            "queues": {"north": 0, "south": 0, "east": 0, "west": 0},
+            "occupancy": 0,
+            "switches": 0,
+            "throughput": 0,
+            "waiting": 0,
+            "config": {
+                "min_green": cfg.min_green,
+                "max_green": cfg.max_green,
+                "yellow": cfg.yellow,
+                "all_red": cfg.all_red,
+                "gap_seconds": cfg.gap_seconds,
+            },
+            "t": 0,
+        }
+
+    def _enter_stage(self, stage: Stage, now: float):
+        """Set the stage and precompute its deadlines in one place."""
+        st = self.state
+        st.stage = stage
+        st.last_change = now
+        if stage is Stage.GREEN:
+            st.min_deadline = now + self._min_green
+            st.stage_deadline = now + self._max_green
+        elif stage is Stage.YELLOW:
+            st.min_deadline = st.stage_deadline = now + self._yellow
+        else:  # ALL_RED
+            # The idle fast-exit may end the stage before the full dwell
+            st.min_deadline = now + min(self._all_red, self._all_red_min_preempt)
+            st.stage_deadline = now + self._all_red + self._all_red_hold_max
 
-    async def request_phase_preference(self, phase: PhaseGroup):
+    async def request_phase_preference(self, phase: Union[Phase, str]):
         """Set a preferred phase to switch to when safe (after min green and when current queue is 0)."""
+        if not isinstance(phase, Phase):
+            phase = Phase[phase]  # accept "NS"/"EW" from API callers
         async with self._lock:
             self.state.pending_phase = phase
-            self._log.info(f"Phase preference requested: {phase}")
+            self._log.info("Phase preference requested: %s", phase.name)
 
     def _current_lights(self) -> Dict[str, str]:
-        if self.state.stage == "GREEN":
-            vertical = "green" if self.state.phase == "NS" else "red"
-            horizontal = "green" if self.state.phase == "EW" else "red"
-        elif self.state.stage == "YELLOW":
-            # Yellow on outgoing direction only
-            vertical = "yellow" if self.state.phase == "NS" else "red"
-            horizontal = "yellow" if self.state.phase == "EW" else "red"
-        else:
-            vertical = horizontal = "red"
-        return {"vertical": vertical, "horizontal": horizontal}
+        return _LIGHTS[self.state.stage][self.state.phase]
 
     async def update_sensor(self, data: Dict):
-        async with self._lock:
-            now = time.time()
-            # Support two formats:
-            # 1) direct counts: {north:int, south:int, east:int, west:int}
-            # 2) incremental: {arrivals:{...}, departures:{...}}
-            if any(k in data for k in ("arrivals", "departures")):
-                arrivals = data.get("arrivals", {}) or {}
-                departures = data.get("departures", {}) or {}
-                for d in ("north", "south", "east", "west"):
-                    a = int(arrivals.get(d, 0) or 0)
-                    b = int(departures.get(d, 0) or 0)
-                    if a:
-                        # Update last arrival for the corresponding phase group
-                        grp = "NS" if d in ("north", "south") else "EW"
-                        self.state.last_arrival[grp] = now
-                    # Adjust queue conservatively (never below 0)
-                    self.state.queues[d] = max(0, int(self.state.queues.get(d, 0)) + a - b)
-                    if b:
-                        self.state.throughput += b
-            else:
-                counts = {k: int(v) for k, v in data.items() if k in ("north", "south", "east", "west")}
-                if counts:
-                    self.state.queues.update({k: max(0, int(v)) for k, v in counts.items()})
-                    if counts.get("north", 0) > 0 or counts.get("south", 0) > 0:
-                        self.state.last_arrival["NS"] = now
-                    if counts.get("east", 0) > 0 or counts.get("west", 0) > 0:
-                        self.state.last_arrival["EW"] = now
-            if "occupancy" in data:
-                try:
-                    self.state.occupancy = max(0, int(data.get("occupancy", 0) or 0))
-                except Exception:
-                    pass
+        """Queue a sensor update; the next tick applies all pending updates in
+        one lock acquisition instead of locking per event."""
+        self._sensor_q.put_nowait(data)
+
+    def _drain_sensor_queue(self, now: float):
+        # Called with the lock held
+        while True:
+            try:
+                data = self._sensor_q.get_nowait()
+            except asyncio.QueueEmpty:
+                break
+            self._apply_sensor(data, now)
+
+    def _apply_sensor(self, data: Dict, now: float):
+        # Support two formats:
+        # 1) direct counts: {north:int, south:int, east:int, west:int}
+        # 2) incremental: {arrivals:{...}, departures:{...}}
+        st = self.state
+        q = st.queues
+        arrivals = data.get("arrivals")
+        departures = data.get("departures")
+        if arrivals is not None or departures is not None:
+            if arrivals is None:
+                arrivals = {}
+            if departures is None:
+                departures = {}
+            for d, idx in _DIR_IDX.items():
+                # JSON sensors send numbers; `or 0` covers missing/None keys
+                # without an int() cast per field
+                a = arrivals.get(d) or 0
+                b = departures.get(d) or 0
+                if a == 0 and b == 0:
+                    continue  # untouched direction: no writes at all
+                if a:
+                    # Update last arrival for the corresponding phase group
+                    st.last_arrival[Phase.NS if idx < EAST else Phase.EW] = now
+                # Adjust queue conservatively (never below 0)
+                old = int(q[idx])
+                new = old + a - b
+                if new < 0:
+                    new = 0
+                q[idx] = new
+                if idx < EAST:
+                    st.ns_sum += new - old
+                else:
+                    st.ew_sum += new - old
+                if b:
+                    st.throughput += b
+        else:
+            arrived_ns = arrived_ew = False
+            for d, idx in _DIR_IDX.items():
+                v = data.get(d)
+                if v is None:
+                    continue
+                count = max(0, int(v))
+                old = int(q[idx])
+                q[idx] = count
+                if idx < EAST:
+                    st.ns_sum += count - old
+                else:
+                    st.ew_sum += count - old
+                if count > 0:
+                    if idx < EAST:
+                        arrived_ns = True
+                    else:
+                        arrived_ew = True
+            if arrived_ns:
+                st.last_arrival[Phase.NS] = now
+            if arrived_ew:
+                st.last_arrival[Phase.EW] = now
+        if "occupancy" in data:
+            try:
+                self.state.occupancy = max(0, int(data.get("occupancy", 0) or 0))
+            except Exception:
+                pass
+
+    def _advance_from_all_red(self, now: float):
+        """Grant green to the preferred phase if set, else toggle."""
+        st = self.state
+        if st.pending_phase is not None:
+            st.phase = st.pending_phase
+            st.pending_phase = None
+        else:
+            st.phase = Phase.EW if st.phase is Phase.NS else Phase.NS
+        self._enter_stage(Stage.GREEN, now)
+        st.switches += 1
 
     async def tick(self):
+        # Fast path without the lock: no stage can end before its minimum
+        # deadline, which covers most ticks. min_deadline is a single float
+        # written only under the lock, and a stale read merely defers the
+        # transition to the next tick, so skipping the lock here is safe.
+        if time.monotonic() < self.state.min_deadline and self._sensor_q.empty():
+            return
         async with self._lock:
-            now = time.time()
-            t_in_stage = now - self.state.last_change
-            if self.state.stage == "GREEN":
-                # Decide whether to stay or start change
-                if t_in_stage < self.cfg.min_green:
+            now = time.monotonic()
+            self._drain_sensor_queue(now)
+            st = self.state
+            if st.stage is Stage.GREEN:
+                # Re-check under the lock; another task may have advanced the stage
+                if now < st.min_deadline:
                     return
-                cur = self.state.phase
-                opp = "EW" if cur == "NS" else "NS"
-                cur_sum = (self.state.queues["north"] + self.state.queues["south"]) if cur == "NS" else (self.state.queues["east"] + self.state.queues["west"])
-                opp_sum = (self.state.queues["east"] + self.state.queues["west"]) if opp == "EW" else (self.state.queues["north"] + self.state.queues["south"])
-                time_since_last_arrival_cur = now - self.state.last_arrival[cur]
+                t_in_stage = now - st.last_change
+                cur = st.phase
+                opp = Phase.EW if cur is Phase.NS else Phase.NS
+                cur_sum, opp_sum = (st.ns_sum, st.ew_sum) if cur is Phase.NS else (st.ew_sum, st.ns_sum)
+                time_since_last_arrival_cur = now - st.last_arrival[cur]
 
                 # Queue-clearing takes precedence: if serving cars, keep green until cleared or max_green
-                if self.cfg.queue_clear and cur_sum > 0 and t_in_stage < self.cfg.max_green:
-                    self._log.debug(f"Hold green for {cur}: queue_clear active cur_sum={cur_sum} t={t_in_stage:.1f}")
+                if self._queue_clear and cur_sum > 0 and now < st.stage_deadline:
+                    self._log.debug("Hold green for %s: queue_clear active cur_sum=%d t=%.1f", cur.name, cur_sum, t_in_stage)
                     return
 
                 # Failsafe max green
-                if t_in_stage >= self.cfg.max_green:
-                    self._log.info(f"Max green reached for {cur} at {t_in_stage:.1f}s; switching")
-                    self.state.stage = "YELLOW"
-                    self.state.last_change = now
+                if now >= st.stage_deadline:
+                    self._log.info("Max green reached for %s at %.1fs; switching", cur.name, t_in_stage)
+                    self._enter_stage(Stage.YELLOW, now)
                     return
 
-                # Priority preemption only if current queue is empty (or queue_clear disabled)
-                if self.cfg.priority_switch and (not self.cfg.queue_clear or cur_sum == 0) and t_in_stage >= self.cfg.min_green:
-                    if opp_sum >= max(self.cfg.priority_min_queue, int(self.cfg.priority_factor * max(1, cur_sum))):
-                        self._log.info(f"Priority switch: cur={cur} cur_sum={cur_sum} opp_sum={opp_sum} t={t_in_stage:.1f}")
-                        self.state.stage = "YELLOW"
-                        self.state.last_change = now
+                # Back-pressure preemption: switch when the opposing backlog
+                # exceeds ours by more than delta_q_lim. A single subtract and
+                # compare replaces the old factor/min-queue threshold.
+                if self._priority_switch and (not self._queue_clear or cur_sum == 0):
+                    if opp_sum - cur_sum >= self._delta_q_lim:
+                        self._log.info("Back-pressure switch: cur=%s cur_sum=%d opp_sum=%d t=%.1f", cur.name, cur_sum, opp_sum, t_in_stage)
+                        self._enter_stage(Stage.YELLOW, now)
                         return
                 # Otherwise, consider switching only if opposing demand exists
                 if opp_sum > 0:
-                    if self.cfg.queue_clear:
+                    if self._queue_clear:
                         # Switch when current cleared
                         if cur_sum == 0:
-                            self._log.info(f"Current queue cleared for {cur}; switching to {opp}")
-                            self.state.stage = "YELLOW"
-                            self.state.last_change = now
+                            self._log.info("Current queue cleared for %s; switching to %s", cur.name, opp.name)
+                            self._enter_stage(Stage.YELLOW, now)
                             return
                     else:
                         # Classic gap-out
-                        if time_since_last_arrival_cur >= self.cfg.gap_seconds:
-                            self._log.info(f"Gap-out switch: no arrivals on {cur} for {time_since_last_arrival_cur:.1f}s; opp has demand {opp_sum}")
-                            self.state.stage = "YELLOW"
-                            self.state.last_change = now
+                        if time_since_last_arrival_cur >= self._gap_seconds:
+                            self._log.info("Gap-out switch: no arrivals on %s for %.1fs; opp has demand %d", cur.name, time_since_last_arrival_cur, opp_sum)
+                            self._enter_stage(Stage.YELLOW, now)
                             return
-            elif self.state.stage == "YELLOW":
-                if t_in_stage >= self.cfg.yellow:
-                    self.state.stage = "ALL_RED"
-                    self.state.last_change = now
+            elif st.stage is Stage.YELLOW:
+                if now >= st.min_deadline:
+                    self._enter_stage(Stage.ALL_RED, now)
+                    return
+            elif st.stage is Stage.ALL_RED:
+                # Fast-exit: an empty intersection with no queued demand does
+                # not need the full all_red dwell, only a short safety minimum
+                idle = st.occupancy == 0 and st.ns_sum + st.ew_sum == 0
+                if idle and now >= st.last_change + self._all_red_min_preempt:
+                    self._advance_from_all_red(now)
                     return
-            elif self.state.stage == "ALL_RED":
                 # Wait for minimum all_red and until intersection occupancy clears, with a maximum extension
-                if t_in_stage >= self.cfg.all_red:
-                    if self.state.occupancy > 0 and t_in_stage < (self.cfg.all_red + self.cfg.all_red_hold_max):
+                if now >= st.last_change + self._all_red:
+                    if st.occupancy > 0 and now < st.stage_deadline:
                         # keep waiting for clearance
                         return
-                    # Grant green to preferred phase if set, else toggle
-                    if self.state.pending_phase and self.state.pending_phase in ("NS", "EW"):
-                        self.state.phase = self.state.pending_phase
-                        self.state.pending_phase = None
-                    else:
-                        self.state.phase = "EW" if self.state.phase == "NS" else "NS"
-                    self.state.stage = "GREEN"
-                    self.state.last_change = now
-                    self.state.switches += 1
+                    self._advance_from_all_red(now)
                     return
 
     def snapshot(self) -> Dict:
-        now = time.time()
+        now = time.monotonic()
         t_in_stage = now - self.state.last_change
         lights = self._current_lights()
-        # Approximate next change time
-        if self.state.stage == "GREEN":
-            # min of remaining min green, possible gap or max
+        # Approximate next change time from the precomputed deadlines
+        if self.state.stage is Stage.GREEN:
             # We don’t know the future arrivals; expose remaining to max as an upper bound
-            time_to_next = max(0, int(self.cfg.max_green - t_in_stage))
-        elif self.state.stage == "YELLOW":
-            time_to_next = max(0, int(self.cfg.yellow - t_in_stage))
+            time_to_next = max(0, int(self.state.stage_deadline - now))
+        elif self.state.stage is Stage.ALL_RED:
+            # min_deadline includes the idle fast-exit, so count down the
+            # normal all_red dwell here; the fast-exit only ends it earlier
+            time_to_next = max(0, int(self.state.last_change + self._all_red - now))
         else:
-            time_to_next = max(0, int(self.cfg.all_red - t_in_stage))
+            time_to_next = max(0, int(self.state.min_deadline - now))
 
-        waiting = sum(self.state.queues.values())
+        q = self.state.queues
+        waiting = self.state.ns_sum + self.state.ew_sum
         self.state.waiting_total = waiting
 
-        return {
-            "phase": self.state.phase,
-            "stage": self.state.stage,
-            "time_in_stage": round(t_in_stage, 2),
-            "time_to_next_change": time_to_next,
-            "lights": lights,
-            "queues": self.state.queues,
-            "occupancy": self.state.occupancy,
-            "switches": self.state.switches,
-            "throughput": self.state.throughput,
-            "waiting": waiting,
-            "config": {
-                "min_green": self.cfg.min_green,
-                "max_green": self.cfg.max_green,
-                "yellow": self.cfg.yellow,
-                "all_red": self.cfg.all_red,
-                "gap_seconds": self.cfg.gap_seconds,
-            },
-            "t": int(now * 1000),
-        }
+        # Mutate the preallocated payload in place; callers serialize it
+        # before the next snapshot() call, so reuse is safe.
+        snap = self._snap
+        snap["phase"] = self.state.phase.name
+        snap["stage"] = self.state.stage.name
+        snap["time_in_stage"] = round(t_in_stage, 2)
+        snap["time_to_next_change"] = time_to_next
+        snap["lights"] = lights
+        sq = snap["queues"]
+        sq["north"] = int(q[NORTH])
+        sq["south"] = int(q[SOUTH])
+        sq["east"] = int(q[EAST])
+        sq["west"] = int(q[WEST])
+        snap["occupancy"] = self.state.occupancy
+        snap["switches"] = self.state.switches
+        snap["throughput"] = self.state.throughput
+        snap["waiting"] = waiting
+        snap["t"] = int(time.time() * 1000)
+        return snap